@@ -1,24 +1,28 @@
 from __future__ import annotations
 
 import asyncio
-from datetime import datetime, timedelta
-from typing import Optional, TypedDict, List, Dict, Any
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, TypedDict, List, Dict, Any, Hashable
 
 import httpx
+import orjson
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from typing_extensions import Annotated
 from pydantic import BaseModel, Field, StringConstraints
 from pydantic_settings import BaseSettings
 
 # Optional LLM (used only if OPENAI_API_KEY present)
 try:
-    from langgraph.graph import StateGraph, END
     from langchain_core.messages import HumanMessage, SystemMessage
     from langchain_openai import ChatOpenAI
 except Exception:  # pragma: no cover
-    StateGraph = END = ChatOpenAI = None  # allow code to run without these libs
+    ChatOpenAI = None  # allow code to run without these libs
 
 
 # =========================
@@ -36,15 +40,17 @@ class Settings(BaseSettings):
         env_file = ".env"
 
 settings = Settings()
+logger = logging.getLogger("trip_planner")
 
 
 # =========================
 # HTTP helpers (retry)
 # =========================
 class ExternalError(RuntimeError): ...
-def _timeout() -> httpx.Timeout: return httpx.Timeout(settings.REQUEST_TIMEOUT_SECONDS)
+HTTP_TIMEOUT = httpx.Timeout(settings.REQUEST_TIMEOUT_SECONDS)
 
 HEADERS_WIKI = {"User-Agent": "TripPlanner/1.0 (github.com/example)"}
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300)
 
 @retry(
     reraise=True,
@@ -54,11 +60,12 @@ HEADERS_WIKI = {"User-Agent": "TripPlanner/1.0 (github.com/example)"}
 )
 async def _get_json(client: httpx.AsyncClient, url: str, *, headers: Dict[str, str] | None = None, params: Dict[str, Any] | None = None) -> Any:
     try:
-        r = await client.get(url, headers=headers, params=params, timeout=_timeout())
+        r = await client.get(url, headers=headers, params=params)  # timeout comes from the client
         if r.status_code >= 500:
             raise ExternalError(f"Server error {r.status_code}")
         r.raise_for_status()
-        return r.json()
+        logger.debug("GET %s -> %s %s", url, r.status_code, r.http_version)
+        return orjson.loads(r.content)
     except httpx.HTTPError as e:
         code = getattr(e.response, "status_code", None)
         if code == 404:
@@ -66,6 +73,34 @@ async def _get_json(client: httpx.AsyncClient, url: str, *, headers: Dict[str, s
         raise ExternalError(str(e)) from e
 
 
+# =========================
+# In-process TTL cache
+# =========================
+class _TTLCache:
+    # small LRU map whose entries expire `ttl` seconds after insertion
+    def __init__(self, ttl: float, maxsize: int = 1024) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        hit = self._data.get(key)
+        if hit is None:
+            return None
+        ts, value = hit
+        if time.monotonic() - ts >= self.ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
 # =========================
 # I/O Schemas
 # =========================
@@ -122,27 +157,62 @@ FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
 WIKI_SEARCH_URL = "https://{lang}.wikipedia.org/w/api.php"
 TICKETMASTER_URL = "https://app.ticketmaster.com/discovery/v2/events.json"
 
+# simple mapping (Open-Meteo WMO weather codes)
+_WMO_CODE_TEXT: Dict[int, str] = {
+    0: "Clear",
+    1: "Partly cloudy", 2: "Partly cloudy", 3: "Partly cloudy",
+    45: "Fog", 48: "Fog",
+    51: "Drizzle", 53: "Drizzle", 55: "Drizzle", 56: "Drizzle", 57: "Drizzle",
+    61: "Rain", 63: "Rain", 65: "Rain", 66: "Rain", 67: "Rain",
+    71: "Snow", 73: "Snow", 75: "Snow", 77: "Snow",
+    80: "Rain showers", 81: "Rain showers", 82: "Rain showers",
+    85: "Snow showers", 86: "Snow showers",
+    95: "Thunderstorm", 96: "Thunderstorm", 99: "Thunderstorm",
+}
+
+def code_to_text(c: int) -> str:
+    return _WMO_CODE_TEXT.get(c, "Mixed")
+
+_GEOCODE_CACHE = _TTLCache(ttl=7 * 24 * 3600, maxsize=1024)  # places don't move
+
 async def geocode(client: httpx.AsyncClient, place: str) -> dict:
-    params = {"name": place, "count": 1, "language": "en", "format": "json"}
+    key = " ".join(place.lower().split())
+    cached = _GEOCODE_CACHE.get(key)
+    if cached is not None:
+        return dict(cached)
+    params = {"name": key, "count": 1, "language": "en", "format": "json"}
     data = await _get_json(client, GEOCODE_URL, params=params)
     results = data.get("results") or []
     if not results:
         raise HTTPException(status_code=404, detail="Destination not found")
     top = results[0]
-    return {
+    geo = {
         "name": top.get("name"),
         "country": top.get("country"),
         "lat": top["latitude"],
         "lon": top["longitude"],
         "timezone": top.get("timezone") or "UTC",
     }
-
-async def forecast(client: httpx.AsyncClient, lat: float, lon: float, days: int, timezone: str) -> List[WeatherDaily]:
+    _GEOCODE_CACHE.put(key, geo)
+    return dict(geo)
+
+_FORECAST_CACHE = _TTLCache(ttl=15 * 60)
+_WIKI_CACHE = _TTLCache(ttl=24 * 3600)
+
+async def forecast(client: httpx.AsyncClient, lat: float, lon: float, days: int, tz: str) -> List[WeatherDaily]:
+    key = (round(lat, 2), round(lon, 2), days, tz)
+    cached = _FORECAST_CACHE.get(key)
+    if cached is not None:
+        # a hit is only good while it still starts on the destination's local today
+        offset_s, days_cached = cached
+        local_today = (datetime.now(timezone.utc) + timedelta(seconds=offset_s)).date().isoformat()
+        if days_cached and days_cached[0].date == local_today:
+            return list(days_cached)
     params = {
         "latitude": lat,
         "longitude": lon,
         "daily": "weathercode,temperature_2m_max,temperature_2m_min,precipitation_sum",
-        "timezone": timezone,
+        "timezone": tz,
     }
     data = await _get_json(client, FORECAST_URL, params=params)
     daily = data.get("daily") or {}
@@ -151,18 +221,6 @@ async def forecast(client: httpx.AsyncClient, lat: float, lon: float, days: int,
     mins = daily.get("temperature_2m_min", [])
     precs = daily.get("precipitation_sum", [])
     codes = daily.get("weathercode", [])
-    def code_to_text(c:int)->str:
-        # simple mapping (Open-Meteo codes)
-        if c in (0,): return "Clear"
-        if c in (1,2,3): return "Partly cloudy"
-        if c in (45,48): return "Fog"
-        if c in (51,53,55,56,57): return "Drizzle"
-        if c in (61,63,65,66,67): return "Rain"
-        if c in (71,73,75,77): return "Snow"
-        if c in (80,81,82): return "Rain showers"
-        if c in (85,86): return "Snow showers"
-        if c in (95,96,99): return "Thunderstorm"
-        return "Mixed"
     out: List[WeatherDaily] = []
     for i, d in enumerate(dates[:days]):
         out.append(WeatherDaily(
@@ -172,49 +230,51 @@ async def forecast(client: httpx.AsyncClient, lat: float, lon: float, days: int,
             precipitation_mm=float(precs[i]),
             condition=code_to_text(int(codes[i]))
         ))
-    return out
+    _FORECAST_CACHE.put(key, (data.get("utc_offset_seconds") or 0, out))
+    return list(out)
 
 async def wiki_pois(client: httpx.AsyncClient, lat: float, lon: float, radius_m: int = 3000, max_items: int = 8, lang: str = "en") -> List[POI]:
-    # 1) GeoSearch for nearby pages
+    key = (round(lat, 3), round(lon, 3), radius_m, max_items, lang)
+    cached = _WIKI_CACHE.get(key)
+    if cached is not None:
+        return list(cached)
+    # GeoSearch as a generator, with summaries + URLs + distance in the same round-trip
     params = {
         "action": "query",
-        "list": "geosearch",
-        "gscoord": f"{lat}|{lon}",
-        "gsradius": radius_m,
-        "gslimit": max_items,
-        "format": "json"
-    }
-    base = WIKI_SEARCH_URL.format(lang=lang)
-    geo = await _get_json(client, base, headers=HEADERS_WIKI, params=params)
-    pages = geo.get("query", {}).get("geosearch", [])
-    if not pages:
-        return []
-    pageids = [str(p["pageid"]) for p in pages]
-    # 2) Extract summaries
-    params2 = {
-        "action": "query",
-        "prop": "extracts|info",
-        "pageids": "|".join(pageids),
+        "generator": "geosearch",
+        "ggscoord": f"{lat}|{lon}",
+        "ggsradius": radius_m,
+        "ggslimit": max_items,
+        "prop": "extracts|info|coordinates",
         "exintro": 1,
         "explaintext": 1,
+        "exchars": 600,  # truncated server-side, keeps the payload small
+        "exlimit": max_items,
         "inprop": "url",
+        "codistancefrompoint": f"{lat}|{lon}",
+        "colimit": "max",
         "format": "json"
     }
-    det = await _get_json(client, base, headers=HEADERS_WIKI, params=params2)
+    base = WIKI_SEARCH_URL.format(lang=lang)
+    det = await _get_json(client, base, headers=HEADERS_WIKI, params=params)
     pages_det = (det.get("query", {}).get("pages") or {}).values()
+    if not pages_det:
+        return []
     out: List[POI] = []
-    for p in pages_det:
+    # generator results come back keyed by pageid; sort nearest-first on the
+    # server-computed distance, pages without coordinates last
+    def _dist(p: Dict[str, Any]) -> float:
+        coords = p.get("coordinates") or []
+        return coords[0].get("dist", 0.0) if coords else float("inf")
+    for p in sorted(pages_det, key=_dist):
         name = p.get("title")
         summary = (p.get("extract") or "").strip()
         url = p.get("fullurl")
-        # distance if present from first result set
-        dkm = None
-        for g in pages:
-            if g["pageid"] == p["pageid"]:
-                dkm = round(g.get("dist", 0.0) / 1000.0, 2)
-                break
-        out.append(POI(name=name, summary=summary[:600], url=url, distance_km=dkm))
-    return out
+        coords = p.get("coordinates") or []
+        dkm = round(coords[0].get("dist", 0.0) / 1000.0, 2) if coords else None
+        out.append(POI(name=name, summary=summary, url=url, distance_km=dkm))
+    _WIKI_CACHE.put(key, out)
+    return list(out)
 
 async def ticketmaster_events(client: httpx.AsyncClient, lat: float, lon: float, start: datetime, end: datetime, radius_km: int = 25) -> List[Event]:
     if not settings.TICKETMASTER_API_KEY:
@@ -231,19 +291,17 @@ async def ticketmaster_events(client: httpx.AsyncClient, lat: float, lon: float,
         "sort": "date,asc",
     }
     data = await _get_json(client, TICKETMASTER_URL, params=params)
-    events = data.get("_embedded", {}).get("events", [])
-    out: List[Event] = []
-    for e in events:
-        title = e.get("name")
-        url = e.get("url")
-        dates = e.get("dates", {}).get("start", {})
-        start_local = dates.get("localDate") or dates.get("dateTime") or ""
-        venue = None
-        ev = e.get("_embedded", {}).get("venues", [])
-        if ev:
-            venue = ev[0].get("name")
-        out.append(Event(title=title, start_local=start_local, venue=venue, url=url))
-    return out
+    return [_event_from(e) for e in (data.get("_embedded") or {}).get("events") or ()]
+
+def _event_from(e: Dict[str, Any]) -> Event:
+    ds = (e.get("dates") or {}).get("start") or {}
+    venues = (e.get("_embedded") or {}).get("venues")
+    return Event(
+        title=e.get("name"),
+        start_local=ds.get("localDate") or ds.get("dateTime") or "",
+        venue=venues[0].get("name") if venues else None,
+        url=e.get("url"),
+    )
 
 
 # =========================
@@ -258,12 +316,13 @@ def summarize_context(dest_label: str, forecast_days: List[WeatherDaily], pois:
         weather_line = f"First day looks {first.condition.lower()}, {temps} with {first.precipitation_mm:.0f}mm precip."
     return f"{dest_label}: {weather_line}. {len(pois)} sights nearby, {len(events)} events found."
 
-def plan_blocks(day_idx: int, date_str: str, pois: List[POI], events: List[Event]) -> DayPlan:
-    # simple rotation through POIs; slot an event in evening if available
-    poi_m = pois[(day_idx * 3 + 0) % max(1, len(pois))]["name"] if pois else "Neighborhood walk"
-    poi_a = pois[(day_idx * 3 + 1) % max(1, len(pois))]["name"] if len(pois) > 1 else "Museum or gallery"
+FALLBACK_SLOTS = ["Neighborhood walk", "Museum or gallery", "Food market & riverfront"]
+
+def plan_blocks(day_idx: int, date_str: str, day_slots: List[str], events: List[Event]) -> DayPlan:
+    # day_slots is this day's [morning, afternoon, evening] from the precomputed rotation; slot an event in evening if available
+    poi_m, poi_a, poi_e = day_slots
     evening_ev = events[day_idx] if day_idx < len(events) else None
-    eve_text = f"Attend: {evening_ev.title} @ {evening_ev.venue}" if evening_ev else (pois[(day_idx * 3 + 2) % max(1, len(pois))]["name"] if len(pois) > 2 else "Food market & riverfront")
+    eve_text = f"Attend: {evening_ev.title} @ {evening_ev.venue}" if evening_ev else poi_e
     meals = ["Local bakery breakfast", "Regional specialty lunch", "Well-reviewed dinner spot"]
     return DayPlan(
         day=day_idx + 1,
@@ -281,9 +340,14 @@ def build_packing_list(forecast_days: List[WeatherDaily]) -> Dict[str, List[str]
     electronics = ["Power adapter", "Power bank"]
 
     if forecast_days:
-        hot = any(d.temp_day_c >= 27 for d in forecast_days)
-        cold = any(d.temp_day_c <= 10 for d in forecast_days)
-        wet  = any(d.precipitation_mm >= 2.0 for d in forecast_days)
+        # single pass over the forecast; stop once every flag is set
+        hot = cold = wet = False
+        for d in forecast_days:
+            t = d.temp_day_c
+            if t >= 27: hot = True
+            if t <= 10: cold = True
+            if d.precipitation_mm >= 2.0: wet = True
+            if hot and cold and wet: break
         if hot: clothing.append("Hat & sunglasses; light fabrics")
         if cold: clothing.append("Warm layer / light jacket")
         if wet:  essentials.append("Compact umbrella / rain jacket")
@@ -296,78 +360,137 @@ def build_packing_list(forecast_days: List[WeatherDaily]) -> Dict[str, List[str]
     }
 
 
+def _or_empty(result: Any, source: str) -> list:
+    # one flaky provider degrades to an empty section instead of failing the whole trip
+    if isinstance(result, Exception):
+        logger.warning("%s provider failed: %r", source, result)
+        return []
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
 # (Optional) LLM polish if OPENAI_API_KEY available
-def maybe_polish(text: str) -> str:
-    if not settings.OPENAI_API_KEY or ChatOpenAI is None:
-        return text
+POLISH_PROMPT = (
+    "Tighten and humanize wording. Keep details; remove fluff. "
+    "You get a JSON object of texts; return a JSON object with exactly the same keys, "
+    "each value rewritten."
+)
+
+# built once per process (None when polish is disabled); JSON mode is bound up front
+_POLISH_LLM = (
+    ChatOpenAI(model=settings.MODEL_NAME, temperature=settings.MODEL_TEMPERATURE, api_key=settings.OPENAI_API_KEY)
+    .bind(response_format={"type": "json_object"})
+    if settings.OPENAI_API_KEY and ChatOpenAI is not None else None
+)
+
+# one LLM round-trip for every text; any key the model drops keeps its original wording
+async def polish_batch(items: Dict[str, str]) -> Dict[str, str]:
+    if not items or _POLISH_LLM is None:
+        return items
     try:
-        llm = ChatOpenAI(model=settings.MODEL_NAME, temperature=settings.MODEL_TEMPERATURE)
-        msg = llm.invoke([
-            SystemMessage(content="Tighten and humanize wording. Keep details; remove fluff."),
-            HumanMessage(content=text),
+        msg = await _POLISH_LLM.ainvoke([
+            SystemMessage(content=POLISH_PROMPT),
+            HumanMessage(content=orjson.dumps(items).decode()),
         ])
-        return msg.content.strip()
+        polished = orjson.loads(msg.content)
     except Exception:
-        return text  # never fail the request on polish
+        return items  # never fail the request on polish
+    out: Dict[str, str] = {}
+    for k, text in items.items():
+        new = polished.get(k) if isinstance(polished, dict) else None
+        out[k] = new.strip() if isinstance(new, str) and new.strip() else text
+    return out
 
 
 # =========================
 # FastAPI
 # =========================
-app = FastAPI(title="Trip Planner (Free-API Edition)", version="2.0.0")
+app = FastAPI(title="Trip Planner (Free-API Edition)", version="2.0.0", default_response_class=ORJSONResponse)
+
+@app.on_event("startup")
+async def _open_http_client() -> None:
+    # one pooled client for the process: keep-alive connections are reused across requests,
+    # and HTTP/2 lets the concurrent upstream calls multiplex over a single connection per host
+    app.state.http = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, http2=True)
+
+@app.on_event("shutdown")
+async def _close_http_client() -> None:
+    await app.state.http.aclose()
 
 @app.post("/plan-trip", response_model=TripResponse)
 async def plan_trip(req: TripRequest):
     destination = req.destination.strip()
     days = req.days
-    today = datetime.utcnow().date()
+    now = datetime.now(timezone.utc)
+    today = now.date()
     dates = [(today + timedelta(days=i)).isoformat() for i in range(days)]
 
-    async with httpx.AsyncClient() as client:
-        # 1) Geocode (Open-Meteo, free)
-        geo = await geocode(client, destination)
-        label = f"{geo['name']}, {geo['country']}"
-        lat, lon, tz = geo["lat"], geo["lon"], geo["timezone"]
+    client: httpx.AsyncClient = app.state.http
 
-        # 2) Parallel fetch: forecast, POIs, events (Ticketmaster optional)
-        start_dt = datetime.utcnow()
-        end_dt = start_dt + timedelta(days=days+1)
-        fc_task = asyncio.create_task(forecast(client, lat, lon, days, tz))
-        poi_task = asyncio.create_task(wiki_pois(client, lat, lon))
-        evt_task = asyncio.create_task(ticketmaster_events(client, lat, lon, start_dt, end_dt))
-        forecast_days, pois, events = await asyncio.gather(fc_task, poi_task, evt_task)
+    # 1) Geocode (Open-Meteo, free)
+    geo = await geocode(client, destination)
+    label = f"{geo['name']}, {geo['country']}"
+    lat, lon, tz = geo["lat"], geo["lon"], geo["timezone"]
+
+    # 2) Parallel fetch: forecast, POIs, events (Ticketmaster optional)
+    start_dt = now
+    end_dt = start_dt + timedelta(days=days+1)
+    calls = [forecast(client, lat, lon, days, tz), wiki_pois(client, lat, lon)]
+    if settings.TICKETMASTER_API_KEY:  # don't schedule a task that would just return []
+        calls.append(ticketmaster_events(client, lat, lon, start_dt, end_dt))
+    fc_res, poi_res, *evt_res = await asyncio.gather(*calls, return_exceptions=True)
+    forecast_days = _or_empty(fc_res, "forecast")
+    pois = _or_empty(poi_res, "pois")
+    events = _or_empty(evt_res[0], "events") if evt_res else []
 
     # 3) Build itinerary blocks
+    # simple rotation through POIs, computed once; slot k falls back when fewer than k+1 POIs
+    poi_names = [p.name for p in pois]
+    n = len(poi_names)
+    slots = [poi_names[j % n] if n > j % 3 else FALLBACK_SLOTS[j % 3] for j in range(3 * days)]
     daily: List[DayPlan] = []
     for i, d in enumerate(dates):
-        daily.append(plan_blocks(i, d, [p.model_dump() for p in pois], [e for e in events]))
+        daily.append(plan_blocks(i, d, slots[3 * i:3 * i + 3], events))
 
     # 4) Summary + packing
     summary_raw = summarize_context(label, forecast_days, pois, events)
-    summary = maybe_polish(summary_raw)
     packing = build_packing_list(forecast_days)
 
-    # 5) Shape response
-    return TripResponse(
-        destination=label,
-        days=days,
-        summary=summary,
-        daily_itinerary=[
+    # 5) Polish all wording in one batch (skipped entirely without an LLM), then shape response
+    summary = summary_raw
+    if _POLISH_LLM is not None:
+        texts: Dict[str, str] = {"summary": summary_raw}
+        for dp in daily:
+            texts[f"day{dp.day}.morning"] = dp.morning
+            texts[f"day{dp.day}.afternoon"] = dp.afternoon
+            texts[f"day{dp.day}.evening"] = dp.evening
+            for j, m in enumerate(dp.meals):
+                texts[f"day{dp.day}.meal{j}"] = m
+        polished = await polish_batch(texts)
+        summary = polished["summary"]
+        daily = [
             DayPlan(
                 day=dp.day,
                 date=dp.date,
-                morning=maybe_polish(dp.morning),
-                afternoon=maybe_polish(dp.afternoon),
-                evening=maybe_polish(dp.evening),
-                meals=[maybe_polish(m) for m in dp.meals],
+                morning=polished[f"day{dp.day}.morning"],
+                afternoon=polished[f"day{dp.day}.afternoon"],
+                evening=polished[f"day{dp.day}.evening"],
+                meals=[polished[f"day{dp.day}.meal{j}"] for j in range(len(dp.meals))],
             )
             for dp in daily
-        ],
+        ]
+
+    return TripResponse(
+        destination=label,
+        days=days,
+        summary=summary,
+        daily_itinerary=daily,
         packing_list=packing,
         context={
             "geo": geo,
-            "forecast": [fd.model_dump() for fd in forecast_days],
-            "pois": [p.model_dump() for p in pois],
-            "events": [e.model_dump() for e in events],
+            "forecast": [fd.model_dump(mode="json") for fd in forecast_days],
+            "pois": [p.model_dump(mode="json") for p in pois],
+            "events": [e.model_dump(mode="json") for e in events],
         },
     )
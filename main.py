@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from functools import lru_cache
 from typing import TypedDict, Optional
 
 from fastapi import FastAPI
@@ -45,7 +46,12 @@ def _has_openai_key() -> bool:
 def _make_llm(model: str = "gpt-4o-mini", temperature: float = 0.3) -> Optional[ChatOpenAI]:
     if not _has_openai_key():
         return None
-    return ChatOpenAI(model=model, temperature=temperature)
+    return _cached_llm(model, temperature, os.getenv("OPENAI_API_KEY"))
+
+@lru_cache(maxsize=8)
+def _cached_llm(model: str, temperature: float, api_key: str) -> ChatOpenAI:
+    # one client per (model, temperature, key); a rotated key builds a fresh client
+    return ChatOpenAI(model=model, temperature=temperature, api_key=api_key)
 
 # ---------- Nodes (Skills) ----------
 def create_itinerary(state: TripState) -> TripState:
@@ -105,7 +111,10 @@ def build_compiled_graph():
 
     return graph.compile()
 
-compiled_app = build_compiled_graph()
+@lru_cache(maxsize=1)
+def _graph():
+    # compiled on first request, not at import
+    return build_compiled_graph()
 
 # ---------- FastAPI ----------
 app = FastAPI(
@@ -140,7 +149,7 @@ def plan_trip(req: TripRequest):
         "itinerary": "",
         "packing_list": "",
     }
-    final_state: TripState = compiled_app.invoke(init_state)
+    final_state: TripState = _graph().invoke(init_state)
     return TripResponse(
         destination=final_state["destination"],
         days=final_state["days"],